@@ -0,0 +1,92 @@
+-- Moves a database created before the task_group table existed onto the
+-- current schema. Task IDs used to be allocated by counting the distinct IDs
+-- already in the task table, starting from 0.
+
+begin;
+
+create table task_group (
+    -- Unique ID for a task, shared by each of its turnpoints in the task table
+    id integer primary key autoincrement
+);
+
+-- Keep every existing task ID, including any that a flight refers to without
+-- having any turnpoints
+insert into task_group (id)
+    select id from task
+    union
+    select task from flight where task is not null;
+
+-- NB the explicit inserts above already move the autoincrement sequence past
+-- max(id), but make sure of it so that new tasks never reuse an old ID
+update sqlite_sequence
+    set seq = (select coalesce(max(id), 0) from task_group)
+    where name = 'task_group';
+
+create table task_new (
+    -- The task that this turnpoint belongs to
+    group_id int not null,
+
+    -- The index of this turnpoint within the task
+    turnpoint_index int,
+
+    -- Usually a three letter string describing the turnpoint
+    turnpoint_code varchar not null,
+    
+    -- NB the primary key's index also serves lookups by group_id alone
+    primary key (group_id, turnpoint_index),
+
+    foreign key (group_id) references task_group (id)
+);
+
+insert into task_new (group_id, turnpoint_index, turnpoint_code)
+    select id, turnpoint_index, turnpoint_code from task;
+
+drop table task;
+alter table task_new rename to task;
+
+-- The flight table's foreign key to task has to be pointed at task_group,
+-- which SQLite only allows by rebuilding the table. The values of flight.task
+-- are carried over unchanged, and all exist in task_group.
+create table flight_new (
+    id integer primary key,
+
+    pilot int,
+    club int,
+    glider int,
+    trace int,
+    flight_date timestamp,
+    scraped_at timestamp,
+    
+    is_weekend boolean,
+    is_junior boolean,
+    is_height boolean,
+    is_two_seater boolean,
+    is_wooden boolean,
+    has_engine boolean,
+    penalty boolean,
+    task int,
+
+    speed float,
+    handicap_speed float,
+    scoring_distance float,
+    speed_points int,
+    height_gain int,
+    height_points int,
+    total_points int,
+    
+    --- The ID used to identify this glider model on the BGA ladder
+    ladder_id int unique,
+
+    foreign key (pilot) references pilot (id),
+    foreign key (club) references club (id),
+    foreign key (glider) references glider (id),
+    foreign key (trace) references trace (id),
+    foreign key (task) references task_group (id)
+);
+
+insert into flight_new select * from flight;
+
+drop table flight;
+alter table flight_new rename to flight;
+
+commit;
@@ -83,9 +83,14 @@ create table trace (
     sha256_hash varchar unique not null
 );
 
+create table task_group (
+    -- Unique ID for a task, shared by each of its turnpoints in the task table
+    id integer primary key autoincrement
+);
+
 create table task (
-    -- Unique ID for this task
-    id int,
+    -- The task that this turnpoint belongs to
+    group_id int not null,
 
     -- The index of this turnpoint within the task
     turnpoint_index int,
@@ -93,10 +98,11 @@ create table task (
     -- Usually a three letter string describing the turnpoint
     turnpoint_code varchar not null,
     
-    primary key (id, turnpoint_index)
-);
+    -- NB the primary key's index also serves lookups by group_id alone
+    primary key (group_id, turnpoint_index),
 
-create index task_id_index on task (id);
+    foreign key (group_id) references task_group (id)
+);
 
 create table flight (
     id integer primary key,
@@ -132,5 +138,5 @@ create table flight (
     foreign key (club) references club (id),
     foreign key (glider) references glider (id),
     foreign key (trace) references trace (id),
-    foreign key (task) references task (id)
+    foreign key (task) references task_group (id)
 );
\ No newline at end of file
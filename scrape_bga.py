@@ -2,10 +2,14 @@
 
 import argparse
 import sqlite3
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import date, datetime, timedelta
 from time import sleep
-from typing import Dict, Optional, Tuple, Callable
+from functools import lru_cache
+from typing import Deque, Dict, List, NamedTuple, Optional, Set, Tuple, Callable
 import requests
+from requests.adapters import HTTPAdapter
 import uuid
 import hashlib
 from pathlib import Path
@@ -25,31 +29,60 @@ logging.basicConfig(
 class NotFound(Exception):
     pass
 
+
+# Shared by every request so that connections to the ladder are kept alive and
+# reused, rather than paying for a new TCP+TLS handshake each time. The pool is
+# sized to comfortably fit every thread in _http_pool.
+_session = requests.Session()
+_session.headers.update({
+    "User-Agent": "Joe Roberts' ladder scraper (joe@jwjr.co.uk)",
+    "From": "joe@jwjr.co.uk",
+})
+_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+
+# The one place that the rate limit on requests to the ladder is enforced. It
+# does nothing else, so that the limiter only ever wraps a single call made
+# right before each request goes out.
 # NB not actually an exponential backoff, just waits 1 second each time
 # @backoff.on_exception(backoff.expo(base=1, factor=1), RateLimitException)
 @sleep_and_retry
 @limits(calls=2, period=3)
-def requests_get(url, params: Dict = dict()):
+def wait_for_rate_limit():
+    pass
+
+
+def requests_get(url, params: Dict = dict(), stream: bool = False):
+    wait_for_rate_limit()
+
     logging.info("Requesting %s params=%s", url, params)
     
-    headers = {
-        "User-Agent": "Joe Roberts' ladder scraper (joe@jwjr.co.uk)",
-        "From": "joe@jwjr.co.uk",
-    }
-
-    r = requests.get(url, params, headers=headers)
+    r = _session.get(url, params=params, stream=stream)
     if r.status_code != 200:
         logging.error("Request to %s returned non-200 status code: %s", url, r.status_code)
+        r.close()
         raise NotFound
     
     return r
 
 
+# Used to overlap the latency of requests to the BGA ladder. NB the rate limit
+# in wait_for_rate_limit is shared between all of the threads, so it remains the
+# ceiling on throughput.
+_http_pool = ThreadPoolExecutor(max_workers=8)
+
+# How many pages of DailyScores to request ahead of the one being processed
+PAGE_PREFETCH = 2
+
+
+# NB the prefill functions hand the raw JSON response straight to SQLite and
+# unpack it there with json_each, rather than building a tuple per row in Python
+
 def prefill_glider_models(cur: sqlite3.Cursor):
     url = "https://www.bgaladder.net/api/Gliders"
-    data = requests_get(url).json()
+    data = requests_get(url).text
 
-    cur.executemany("""
+    cur.execute("""
         insert into glider_model (
             model_name,
             seats,
@@ -57,25 +90,25 @@ def prefill_glider_models(cur: sqlite3.Cursor):
             turbo,
             handicap,
             ladder_id
-        ) values (
-            ?, ?, ?, ?, ?, ?
         )
-        """, ((
-            g["GliderType"],
-            g["Seats"],
-            g["Vintage"],
-            g["Turbo"],
-            g["Handicap"],
-            g["GliderID"],
-        ) for g in data)
+        select
+            json_extract(value, '$.GliderType'),
+            json_extract(value, '$.Seats'),
+            json_extract(value, '$.Vintage'),
+            json_extract(value, '$.Turbo'),
+            json_extract(value, '$.Handicap'),
+            json_extract(value, '$.GliderID')
+        from json_each(?)
+        """, (data,)
     )
     
 
 def prefill_launch_points(cur: sqlite3.Cursor):
     url = "https://www.bgaladder.net/api/LaunchPoints"
-    data = requests_get(url).json()
+    data = requests_get(url).text
 
-    cur.executemany("""
+    # NB the ladder gives altitudes in feet
+    cur.execute("""
         insert into launch_point (
             site_name,
             lat,
@@ -83,34 +116,45 @@ def prefill_launch_points(cur: sqlite3.Cursor):
             height_amsl,
             ladder_id,
             club_ladder_code
-        ) values (?, ?, ?, ?, ?, ?)
-        """, ((
-            l["Site"],
-            l["Latitude"],
-            l["Longitude"],
-            l["Altitude"] * 0.3048,
-            l["LPCode"],
-            l["ClubID"] if l["ClubID"] != "" else None
-        ) for l in data)
+        )
+        select
+            json_extract(value, '$.Site'),
+            json_extract(value, '$.Latitude'),
+            json_extract(value, '$.Longitude'),
+            json_extract(value, '$.Altitude') * 0.3048,
+            json_extract(value, '$.LPCode'),
+            nullif(json_extract(value, '$.ClubID'), '')
+        from json_each(?)
+        """, (data,)
     )
 
     
 def prefill_clubs(cur: sqlite3.Cursor):
     url = "https://www.bgaladder.net/api/Clubs"
-    data = requests_get(url).json()
+    data = requests_get(url).text
 
-    cur.executemany(
-        "insert into club (club_name, is_university, ladder_code) values ( ?, ?, ?)",
-        ((c["Name"], c["University"], c["ID"]) for c in data)
+    cur.execute("""
+        insert into club (club_name, is_university, ladder_code)
+        select
+            json_extract(value, '$.Name'),
+            json_extract(value, '$.University'),
+            json_extract(value, '$.ID')
+        from json_each(?)
+        """, (data,)
     )
     
 def prefill_pilots(cur: sqlite3.Cursor):
     url = "https://www.bgaladder.net/api/ActivePilots"
-    data = requests_get(url).json()
+    data = requests_get(url).text
 
-    cur.executemany(
-        "insert into pilot (forename, surname, ladder_id) values (?, ?, ?)",
-        ((p["ForeName"], p["Surname"], p["ID"]) for p in data)
+    cur.execute("""
+        insert into pilot (forename, surname, ladder_id)
+        select
+            json_extract(value, '$.ForeName'),
+            json_extract(value, '$.Surname'),
+            json_extract(value, '$.ID')
+        from json_each(?)
+        """, (data,)
     )
 
 def init_database(db: sqlite3.Connection):
@@ -127,184 +171,381 @@ def init_database(db: sqlite3.Connection):
     db.commit()
 
 
+# Brings a database created by an older version of schema.sql up to date
+def migrate_database(db: sqlite3.Connection):
+    def has_table(name: str) -> bool:
+        cur = db.execute("select 1 from sqlite_master where type = 'table' and name = ?", (name,))
+        return cur.fetchone() is not None
+
+    if has_table("task") and not has_table("task_group"):
+        logging.info("Migrating task table to use task_group")
+        with open("migrations/task_group.sql") as f:
+            db.executescript(f.read())
+
+
+# In-memory caches of the mapping from BGA ladder identifiers to our own row
+# IDs. The same pilots/clubs/gliders turn up over and over again while
+# scraping, so this saves a round trip to the database for the vast majority
+# of flights.
+_pilot_cache: Dict[int, int] = dict()
+_club_cache: Dict[str, int] = dict()
+_glider_model_cache: Dict[str, int] = dict()
+_glider_cache: Dict[str, int] = dict()
+
+# NB unlike the others, this isn't primed up front. Traces are only ever looked
+# up for newly scraped flights, so it's filled in a page at a time instead.
+_trace_cache: Dict[str, int] = dict()
+
+# The ladder IDs of every flight already in the database, used to avoid
+# downloading traces for flights that we already have
+_known_flight_ids: Set[int] = set()
+
+
+def prime_caches(cur: sqlite3.Cursor):
+    cur.execute("select ladder_id, id from pilot")
+    _pilot_cache.update(cur.fetchall())
+
+    cur.execute("select ladder_code, id from club")
+    _club_cache.update(cur.fetchall())
+
+    cur.execute("select model_name, id from glider_model")
+    _glider_model_cache.update(cur.fetchall())
+
+    cur.execute("select reg, id from glider")
+    _glider_cache.update(cur.fetchall())
+
+    cur.execute("select ladder_id from flight")
+    _known_flight_ids.update(row[0] for row in cur.fetchall())
+
+
+# NB each of the following upserts relies on the uniqueness constraint on the
+# conflict column. The no-op "do update" (rather than "do nothing") is what
+# makes "returning" hand back the ID of an existing row, so that both the
+# insert and the lookup path are a single statement.
+
+SQL_UPSERT_PILOT = """
+    insert into pilot (forename, surname, ladder_id) values (?, ?, ?)
+    on conflict (ladder_id) do update set ladder_id = excluded.ladder_id
+    returning id
+"""
+
 def get_or_create_pilot(cur: sqlite3.Cursor, forename: str, surname: str, ladder_id: int) -> int:
-    cur.execute("""
-        select (id)
-        from pilot
-        where
-            forename = ?
-            and surname = ?
-            and ladder_id = ?
-        """, (forename, surname, ladder_id)
-    )
-    existing = cur.fetchone()
-    if existing is not None:
-        return existing[0]
-    
-    cur.execute(
-        "insert into pilot (forename, surname, ladder_id) values (?, ?, ?)",
-        (forename, surname, ladder_id)
-    )
+    cached = _pilot_cache.get(ladder_id)
+    if cached is not None:
+        return cached
 
-    # NB there's a uniqueness constraint on ladder_id, and we know that we just
-    # inserted a non-null value
-    cur.execute("select (id) from pilot where ladder_id = ?", (ladder_id,))
-    return cur.fetchone()[0]
+    cur.execute(SQL_UPSERT_PILOT, (forename, surname, ladder_id))
+    pilot_id = cur.fetchone()[0]
+    _pilot_cache[ladder_id] = pilot_id
+    return pilot_id
 
 
+# NB club_name is not null, and SQLite checks that before considering the
+# conflict clause. Clubs that weren't in the prefilled list are named after
+# their ladder code until we know better.
+SQL_UPSERT_CLUB = """
+    insert into club (club_name, ladder_code) values (?, ?)
+    on conflict (ladder_code) do update set ladder_code = excluded.ladder_code
+    returning id
+"""
+
 def get_or_create_club(cur: sqlite3.Cursor, bgal_club_code: str) -> int:
-    cur.execute("select (id) from club where ladder_code = ?", (bgal_club_code,))
-    existing = cur.fetchone()
-    if existing is not None:
-        return existing[0]
-    
-    cur.execute("insert into club (ladder_code) values (?)", (bgal_club_code,))
-    cur.execute("select (id) from club where ladder_code = ?", (bgal_club_code,))
-    return cur.fetchone()[0]
+    cached = _club_cache.get(bgal_club_code)
+    if cached is not None:
+        return cached
+
+    cur.execute(SQL_UPSERT_CLUB, (bgal_club_code, bgal_club_code))
+    club_id = cur.fetchone()[0]
+    _club_cache[bgal_club_code] = club_id
+    return club_id
 
 
+SQL_UPSERT_GLIDER_MODEL = """
+    insert into glider_model (model_name, ladder_id) values (?, ?)
+    on conflict (model_name) do update set model_name = excluded.model_name
+    returning id
+"""
+
 def get_or_create_glider_model(cur: sqlite3.Cursor, model_name: str, bgal_model_id: int) -> int:
-    cur.execute("select (id) from glider_model where model_name = ?", (model_name,))
-    existing = cur.fetchone()
-    if existing is not None:
-        return existing[0]
-    
-    cur.execute("insert into glider_model (model_name, ladder_id) values (?, ?)", (model_name, bgal_model_id))
-    cur.execute("select (id) from glider_model where ladder_id = ?", (bgal_model_id,))
-    return cur.fetchone()[0]
+    cached = _glider_model_cache.get(model_name)
+    if cached is not None:
+        return cached
+
+    cur.execute(SQL_UPSERT_GLIDER_MODEL, (model_name, bgal_model_id))
+    model_id = cur.fetchone()[0]
+    _glider_model_cache[model_name] = model_id
+    return model_id
+
 
+SQL_UPSERT_GLIDER = """
+    insert into glider (reg, model) values (?, ?)
+    on conflict (reg) do update set reg = excluded.reg
+    returning id
+"""
 
 def get_or_create_glider(cur: sqlite3.Cursor, reg: str, model_id: int) -> int:
-    cur.execute("select (id) from glider where reg = ?", (reg,))
-    existing = cur.fetchone()
-    if existing is not None:
-        return existing[0]
-    
-    cur.execute("insert into glider (reg, model) values (?, ?)", (reg, model_id))
-    cur.execute("select (id) from glider where reg = ?", (reg,))
-    return cur.fetchone()[0]
+    cached = _glider_cache.get(reg)
+    if cached is not None:
+        return cached
 
+    cur.execute(SQL_UPSERT_GLIDER, (reg, model_id))
+    glider_id = cur.fetchone()[0]
+    _glider_cache[reg] = glider_id
+    return glider_id
 
-def insert_task(cur: sqlite3.Cursor, flight_details: Dict) -> int:
-    cur.execute("select count(distinct id) from task")
-    task_id = cur.fetchone()[0]
 
-    turnpoint_codes = list()
-    def maybe_append(code: Optional[str]) -> bool:
-        if code is None or code == "":
-            return False
-        else:
-            turnpoint_codes.append(code)
-            return True
-    
-    maybe_append(flight_details.get("StartPoint"))
-    for i in itertools.count(1):
-        if not maybe_append(flight_details.get(f"TP{i}")):
-            break
-    maybe_append(flight_details.get("FinishPoint"))
-
-    cur.executemany(
-        "insert into task (id, turnpoint_index, turnpoint_code) values (?, ?, ?)",
-        ((task_id, i, code) for (i, code) in enumerate(turnpoint_codes))
+# SQLite's default limit on the number of parameters bound to one statement
+SQLITE_MAX_VARIABLES = 999
+
+
+# Builds an insert statement for `group_size` rows at a time. Cached so that
+# each statement is only built once, after which sqlite3 finds the already
+# prepared statement in its own statement cache.
+@lru_cache(maxsize=None)
+def insert_sql(table: str, columns: Tuple[str, ...], group_size: int) -> str:
+    row_placeholders = "(" + ", ".join("?" * len(columns)) + ")"
+    return (
+        f"insert into {table} ({', '.join(columns)}) values "
+        + ", ".join([row_placeholders] * group_size)
+    )
+
+
+# Inserts rows into the given table, packing up to `group` rows into the
+# values clause of each statement so that SQLite doesn't have to re-run the
+# statement once per row. Any leftover rows go through the single row form.
+def chunked_insert(cur: sqlite3.Cursor, table: str, columns: Tuple[str, ...], rows: List[Tuple], group: int = 50):
+    group = max(1, min(group, SQLITE_MAX_VARIABLES // len(columns)))
+
+    grouped_len = len(rows) - len(rows) % group
+    if grouped_len > 0:
+        cur.executemany(
+            insert_sql(table, columns, group),
+            (
+                tuple(itertools.chain.from_iterable(rows[i:i + group]))
+                for i in range(0, grouped_len, group)
+            )
+        )
+
+    cur.executemany(insert_sql(table, columns, 1), rows[grouped_len:])
+
+
+TASK_COLUMNS = (
+    "group_id",
+    "turnpoint_index",
+    "turnpoint_code",
+)
+
+
+SQL_INSERT_TASK_GROUP = "insert into task_group default values"
+
+# Allocates a new task ID, and appends a row for each of its turnpoints to
+# task_rows for the caller to insert in bulk
+def create_task(cur: sqlite3.Cursor, flight_details: Dict, task_rows: List[Tuple]) -> int:
+    cur.execute(SQL_INSERT_TASK_GROUP)
+    task_id = cur.lastrowid
+
+    # The intermediate turnpoints are in the fields TP1, TP2, ..., so pick them
+    # out in a single pass over the keys rather than probing for each in turn
+    tp_keys = sorted(
+        (k for k in flight_details if k.startswith("TP") and k[2:].isdigit()),
+        key=lambda k: int(k[2:])
     )
+    codes = [
+        flight_details.get("StartPoint"),
+        *(flight_details[k] for k in tp_keys),
+        flight_details.get("FinishPoint"),
+    ]
+
+    # Unused turnpoint fields are null or empty
+    turnpoint_codes = [code for code in codes if code]
+
+    task_rows.extend((task_id, i, code) for (i, code) in enumerate(turnpoint_codes))
 
     return task_id
 
-def download_and_archive_trace(cur: sqlite3.Cursor, archive_root: Path, flight_details: Dict) -> Optional[int]:
+class DownloadedTrace(NamedTuple):
+    downloaded_at: datetime
+    sha256_hash: str
+
+    # Where the trace was streamed to, before being moved into the archive
+    temp_path: Path
+
+
+def download_trace(archive_root: Path, flight_details: Dict) -> Optional[DownloadedTrace]:
     flight_id = flight_details["FlightID"]
     url = f"https://www.bgaladder.net/FlightIGC/{flight_id}"
 
-    original_filename = flight_details["LoggerFile"]
-
-    logging.debug("Downloading %s from %s", original_filename, url)
+    logging.debug("Downloading %s from %s", flight_details["LoggerFile"], url)
     downloaded_at = datetime.now()
 
     try:
-        r = requests_get(url)
+        r = requests_get(url, stream=True)
     except NotFound:
         return None
 
-    sha256_hash = hashlib.sha256(r.content).hexdigest()
+    # Stream the body straight to disk, hashing it on the way through, rather
+    # than buffering the whole thing in memory first. The temporary file lives
+    # under the archive root so that it can be renamed into place.
+    h = hashlib.sha256()
+    temp_path = archive_root.joinpath(f"{uuid.uuid4()}.tmp")
+    try:
+        with r, open(temp_path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=256 * 1024):
+                h.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
 
-    cur.execute("select (id) from trace where sha256_hash = ?", (sha256_hash,))
-    existing = cur.fetchone()
-    if existing is not None:
-        logging.warning("Found existing trace in DB with same hash: %s", sha256_hash)
-        return existing[0]
+    return DownloadedTrace(downloaded_at, h.hexdigest(), temp_path)
 
-    # Simple path strategy to ensure that we don't store too many files in one directory
-    archive_path = Path(sha256_hash[0], sha256_hash[1], sha256_hash)
 
-    full_path = archive_root.joinpath(archive_path)
-    full_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(full_path, "wb") as f:
-        f.write(r.content)
-        
-    cur.execute(
-        "insert into trace (downloaded_at, original_filename, sha256_hash) values (?, ?, ?)",
-        (downloaded_at, original_filename, sha256_hash)
-    )
+# The archive directories that we've already made sure exist, so that we don't
+# have to ask the filesystem again for every trace
+_known_prefix_dirs: Set[Path] = set()
 
-    cur.execute("select (id) from trace where sha256_hash = ?", (sha256_hash,))
-    return cur.fetchone()[0]
 
+# Where a trace with the given hash lives, relative to the archive root.
+# Simple path strategy to ensure that we don't store too many files in one
+# directory. Two levels of 256 directories each keeps even a very large archive
+# down to a handful of files per directory.
+def trace_archive_path(sha256_hash: str) -> Path:
+    return Path(sha256_hash[0:2], sha256_hash[2:4], sha256_hash)
 
-class ExistingFlight(Exception):
-    pass
+
+# Moves any traces still stored in the original <h[0]>/<h[1]>/<h> layout into
+# the current one. The old top level directories have single character names,
+# so once they've all been moved this only costs a listing of the archive root.
+def migrate_archive_layout(archive_root: Path):
+    for old_dir in list(archive_root.iterdir()):
+        if not old_dir.is_dir() or len(old_dir.name) != 1:
+            continue
+
+        logging.info("Moving traces in %s to the current archive layout", old_dir)
+        for old_path in old_dir.glob("*/*"):
+            new_path = archive_root.joinpath(trace_archive_path(old_path.name))
+            new_path.parent.mkdir(parents=True, exist_ok=True)
+            old_path.replace(new_path)
+
+        for sub_dir in old_dir.iterdir():
+            sub_dir.rmdir()
+        old_dir.rmdir()
+
+
+TRACE_COLUMNS = (
+    "downloaded_at",
+    "original_filename",
+    "sha256_hash",
+)
+
+
+# Fills in _trace_cache for any of the given hashes that are already in the
+# database, with one grouped query per batch rather than one query per trace
+def lookup_trace_ids(cur: sqlite3.Cursor, hashes: List[str]):
+    for i in range(0, len(hashes), SQLITE_MAX_VARIABLES):
+        batch = hashes[i:i + SQLITE_MAX_VARIABLES]
+        cur.execute(
+            "select sha256_hash, id from trace where sha256_hash in (" + ", ".join("?" * len(batch)) + ")",
+            batch
+        )
+        _trace_cache.update(cur.fetchall())
+
+
+# Moves each of a page's downloaded traces into the archive and records any
+# that we didn't already have, returning the trace ID (if any) for each flight
+def archive_traces(
+        cur: sqlite3.Cursor,
+        archive_root: Path,
+        flights: List[Dict],
+        traces: List[Optional[DownloadedTrace]]
+    ) -> List[Optional[int]]:
+    lookup_trace_ids(cur, list({
+        t.sha256_hash for t in traces
+        if t is not None and t.sha256_hash not in _trace_cache
+    }))
+
+    new_hashes = set()
+    trace_rows = list()
+    for flight_details, trace in zip(flights, traces):
+        if trace is None:
+            continue
+
+        downloaded_at, sha256_hash, temp_path = trace
+        if sha256_hash in _trace_cache or sha256_hash in new_hashes:
+            logging.warning("Found existing trace in DB with same hash: %s", sha256_hash)
+            temp_path.unlink()
+            continue
+
+        full_path = archive_root.joinpath(trace_archive_path(sha256_hash))
+        prefix_dir = full_path.parent
+        if prefix_dir not in _known_prefix_dirs:
+            prefix_dir.mkdir(parents=True, exist_ok=True)
+            _known_prefix_dirs.add(prefix_dir)
+        temp_path.replace(full_path)
+
+        new_hashes.add(sha256_hash)
+        trace_rows.append((downloaded_at, flight_details["LoggerFile"], sha256_hash))
+
+    chunked_insert(cur, "trace", TRACE_COLUMNS, trace_rows)
+    lookup_trace_ids(cur, list(new_hashes))
+
+    return [_trace_cache[t.sha256_hash] if t is not None else None for t in traces]
 
 
 class MissingTrace(Exception):
     pass
 
 
-def insert_bga_flight(db: sqlite3.Connection, archive_root: Path, flight_details: Dict, scraped_at: datetime):
+# NB must match the order of the rows returned by resolve_bga_flight
+FLIGHT_COLUMNS = (
+    "pilot",
+    "club",
+    "glider",
+    "trace",
+    "flight_date",
+    "scraped_at",
+    "is_weekend",
+    "is_junior",
+    "is_height",
+    "is_two_seater",
+    "is_wooden",
+    "has_engine",
+    "penalty",
+    "task",
+    "speed",
+    "handicap_speed",
+    "scoring_distance",
+    "speed_points",
+    "height_gain",
+    "height_points",
+    "total_points",
+    "ladder_id",
+)
+
+
+# Resolves everything that a flight refers to, creating rows as needed, and
+# returns the fully bound row for the caller to insert into the flight table
+def resolve_bga_flight(
+        cur: sqlite3.Cursor,
+        flight_details: Dict,
+        trace_id: Optional[int],
+        scraped_at: datetime,
+        task_rows: List[Tuple]
+    ) -> Tuple:
     fd = flight_details
-    cur = db.cursor()
-    
     ladder_id = fd["FlightID"]
 
-    cur.execute("select (id) from flight where ladder_id = ?", (ladder_id,))
-    if cur.fetchone() is not None:
-        logging.debug("Flight with ID %s was already in database", ladder_id)
-        raise ExistingFlight
-    
     logging.debug("Inserting BGA Ladder flight with ID %s", ladder_id)
 
     pilot_id = get_or_create_pilot(cur, fd["Forename"], fd["Surname"], fd["PilotID"])
     club_id = get_or_create_club(cur, fd["ClubID"])
     glider_model_id = get_or_create_glider_model(cur, fd["Glider"], fd["GliderCode"])
     glider_id = get_or_create_glider(cur, fd["Registration"], glider_model_id)
-    trace_id = download_and_archive_trace(cur, archive_root, flight_details)
-    task_id = insert_task(cur, fd)
+    task_id = create_task(cur, fd, task_rows)
     
-    flight_date = datetime.strptime(fd["FlightDate"], "%Y-%m-%dT%H:%M:%S")
+    flight_date = datetime.fromisoformat(fd["FlightDate"])
     
-    cur.execute("""
-        insert into flight (
-            pilot,
-            club,
-            glider,
-            trace,
-            flight_date,
-            scraped_at,
-            is_weekend,
-            is_junior,
-            is_height,
-            is_two_seater,
-            is_wooden,
-            has_engine,
-            penalty,
-            task,
-            speed,
-            handicap_speed,
-            scoring_distance,
-            speed_points,
-            height_gain,
-            height_points,
-            total_points,
-            ladder_id
-        ) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+    return (
         pilot_id,
         club_id,
         glider_id,
@@ -327,13 +568,67 @@ def insert_bga_flight(db: sqlite3.Connection, archive_root: Path, flight_details
         fd["HeightPoints"],
         fd["TotalPoints"],
         ladder_id,
-    ))
+    )
 
-    db.commit()
+
+def insert_bga_page(cur: sqlite3.Cursor, archive_root: Path, flights: List[Dict], scraped_at: datetime) -> int:
+    db = cur.connection
+
+    new_flights = list()
+    seen = set()
+    for flight_details in flights:
+        ladder_id = flight_details["FlightID"]
+        if ladder_id in _known_flight_ids:
+            logging.debug("Flight with ID %s was already in database", ladder_id)
+        elif ladder_id in seen:
+            logging.debug("Flight with ID %s appeared more than once in the same page", ladder_id)
+        else:
+            seen.add(ladder_id)
+            new_flights.append(flight_details)
+
+    # Downloading the traces is entirely latency bound, so fetch all of them
+    # concurrently before taking the write lock. All of the database work stays
+    # on this thread.
+    futures = [_http_pool.submit(download_trace, archive_root, fd) for fd in new_flights]
+    try:
+        traces = [f.result() for f in futures]
+    except BaseException:
+        # Don't leave the temporary files from the rest of the page's downloads
+        # lying around in the archive
+        for f in futures:
+            f.cancel()
+        wait(futures)
+        for f in futures:
+            if not f.cancelled() and f.exception() is None and f.result() is not None:
+                f.result().temp_path.unlink(missing_ok=True)
+        raise
+
+    # Commit once per page rather than once per flight, so that SQLite only has
+    # to sync to disk once for the whole page
+    db.execute("begin immediate")
+    with db:
+        trace_ids = archive_traces(cur, archive_root, new_flights, traces)
+
+        flight_rows = list()
+        task_rows = list()
+        for flight_details, trace_id in zip(new_flights, trace_ids):
+            flight_rows.append(resolve_bga_flight(cur, flight_details, trace_id, scraped_at, task_rows))
+
+        chunked_insert(cur, "task", TASK_COLUMNS, task_rows)
+        chunked_insert(cur, "flight", FLIGHT_COLUMNS, flight_rows)
+
+    _known_flight_ids.update(fd["FlightID"] for fd in new_flights)
+
+    return len(new_flights)
     
 
+def log_failed_prefetch(f: Future):
+    if f.exception() is not None:
+        logging.error("Prefetching a page of flights failed", exc_info=f.exception())
+
+
 def get_daily_flights(
-        process: Callable[[datetime, Dict], None],
+        process: Callable[[datetime, List[Dict]], None],
         query_season: Optional[int],
         query_month: Optional[int]=None,
         query_day: Optional[int]=None,
@@ -349,33 +644,55 @@ def get_daily_flights(
     if query_day is not None:
         params["Day"] = query_day
     
+    def fetch_page(page: int) -> Tuple[datetime, List[Dict]]:
+        r = requests_get(base_url, { **params, "page": page })
+        return (datetime.now(), r.json()["rows"])
+
+    # Fetch the first page on its own, since most queries (eg a single day) fit
+    # on one page and shouldn't pay for speculatively requesting any more
+    pages = itertools.count(1)
+    result = fetch_page(next(pages))
+
+    # Once a page comes back full, keep the next few pages downloading in the
+    # background while this one is processed. Pages are still processed in
+    # order on this thread.
+    pending: Deque[Future] = deque()
+
     total_found = 0
-    for page in itertools.count(1):
-        params["page"] = page
-        r = requests_get(base_url, params)
-        scraped_at = datetime.now()
-        flights = r.json()["rows"]
-
-        for flight in flights:
-            process(scraped_at, flight)
-
-        total_found = total_found + len(flights)
-        if len(flights) < page_size:
-            break
+    try:
+        while True:
+            scraped_at, flights = result
+
+            if len(flights) == page_size:
+                while len(pending) < PAGE_PREFETCH:
+                    pending.append(_http_pool.submit(fetch_page, next(pages)))
+
+            process(scraped_at, flights)
+
+            total_found = total_found + len(flights)
+            if len(flights) < page_size:
+                break
+
+            result = pending.popleft().result()
+    finally:
+        # Whether we ran off the end of the results or process() raised, drop
+        # any prefetches that haven't started yet. Ones that are already
+        # running can't be interrupted, so they're allowed to finish in the
+        # background, but make sure anything they raise still gets logged.
+        for f in pending:
+            if not f.cancel():
+                f.add_done_callback(log_failed_prefetch)
             
     return total_found
 
 def scrape_day(db: sqlite3.Connection, archive_root: Path, query_date: date) -> Tuple[int, int]:
     logging.info("Scraping flights for %s", query_date)
     
+    cur = db.cursor()
     new_flights = 0
-    def process(scraped_at, flight_details):
+    def process(scraped_at, flights):
         nonlocal new_flights
-        try:
-            insert_bga_flight(db, archive_root, flight_details, scraped_at)
-            new_flights = new_flights + 1
-        except ExistingFlight:
-            pass
+        new_flights = new_flights + insert_bga_page(cur, archive_root, flights, scraped_at)
 
     total_found = get_daily_flights(
         process=process,
@@ -408,14 +725,11 @@ def scrape_last_n_days(db: sqlite3.Connection, archive_root: Path, lookback_days
 def scrape_season(db: sqlite3.Connection, archive_root: Path, season: int):
     logging.info("Scraping all flights for the %s season", season)
 
+    cur = db.cursor()
     new_flights = 0
-    def process(scraped_at, flight_details):
+    def process(scraped_at, flights):
         nonlocal new_flights
-        try:
-            insert_bga_flight(db, archive_root, flight_details, scraped_at)
-            new_flights = new_flights + 1
-        except ExistingFlight:
-            pass
+        new_flights = new_flights + insert_bga_page(cur, archive_root, flights, scraped_at)
 
     total_found = get_daily_flights(process, season)
 
@@ -426,11 +740,22 @@ def scrape_season(db: sqlite3.Connection, archive_root: Path, season: int):
     )
 
 def main(args):
-    db = sqlite3.connect(args.db)
+    db = sqlite3.connect(args.db, cached_statements=256)
+    db.execute("pragma journal_mode = wal")
+    db.execute("pragma synchronous = normal")
+    db.execute("pragma temp_store = memory")
+    db.execute("pragma cache_size = -65536")
     
     if args.init_db:
         init_database(db)
+    else:
+        migrate_database(db)
+
+    prime_caches(db.cursor())
         
+    args.archive_root.mkdir(parents=True, exist_ok=True)
+    migrate_archive_layout(args.archive_root)
+
     if args.scrape_last_n_days is not None:
         scrape_last_n_days(db, args.archive_root, args.scrape_last_n_days)
 